@@ -0,0 +1,295 @@
+import hashlib
+import json
+from typing import Iterable, Iterator, NamedTuple
+
+import numpy as np
+from numpy import ndarray
+
+import preferences
+from files.file import File
+from files.processor.feature_graph import BATCHABLE_FIELDS, compute_features, frame_count, requested_fields
+from files.processor.sound_processor import SoundProcessor
+from files.processor.typings import SPT
+
+# Fields feature-domain augmentations are applied to, (frequency, frames) spectrograms
+SPECTROGRAM_FIELDS = ['stft', 'mel']
+
+# Fixed length of stacked PCM
+BATCH_LENGTH = int(preferences.MAX_DURATION * preferences.SAMPLE_RATE)
+
+
+class AugmentationRecipe(NamedTuple):
+    """Ranges are (low, high), each variant of a sound draws its own value uniformly from them.
+    Neutral values (the defaults) disable an augmentation
+    """
+    seed: int = 0
+    # How many augmented versions of each sound are produced
+    variants: int = 1
+
+    # PCM domain, applied to batches of stacked fixed length samples
+    gain_db: tuple[float, float] = (0.0, 0.0)
+    # Tape style pitch shift (resampling), in semitones. Shorter when shifted up, longer (truncated) when shifted down
+    pitch_shift: tuple[float, float] = (0.0, 0.0)
+    # Signal to noise ratio of the white noise mixed in, None for no noise
+    noise_snr_db: tuple[float, float] | None = None
+    # Delay (positive) or advance (negative) of the transient, in seconds
+    transient_shift: tuple[float, float] = (0.0, 0.0)
+
+    # Feature domain, applied to stft and mel spectrograms (cached or freshly extracted)
+    # Time stretch rate, as a resampling of the frame axis. Higher is faster (fewer frames)
+    time_stretch: tuple[float, float] = (1.0, 1.0)
+    # Maximum fraction of the frequency bins to be masked (set to the minimum of the spectrogram)
+    freq_mask: float = 0.0
+    # Maximum fraction of the frames to be masked
+    time_mask: float = 0.0
+
+    def fingerprint(self) -> str:
+        serialized = json.dumps(self._asdict(), sort_keys=True)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def needs_pcm(self) -> bool:
+        return (
+            self.gain_db != (0.0, 0.0)
+            or self.pitch_shift != (0.0, 0.0)
+            or self.noise_snr_db is not None
+            or self.transient_shift != (0.0, 0.0)
+        )
+
+    def needs_spectrograms(self) -> bool:
+        return self.time_stretch != (1.0, 1.0) or self.freq_mask > 0.0 or self.time_mask > 0.0
+
+
+# PCM DOMAIN
+# batch: (n, samples), every parameter array: (n,)
+
+def stack_sounds(sounds: Iterable[ndarray], length: int = BATCH_LENGTH) -> tuple[ndarray, ndarray]:
+    """Stack samples (as returned by `preferences.load_sound`) into a zero padded / truncated (n, length) batch
+
+    :return: the batch and the real length of each row (n,)
+    """
+    sounds = list(sounds)
+    batch = np.zeros((len(sounds), length), dtype=np.float32)
+    lengths = np.zeros(len(sounds), dtype=np.int64)
+    for (row, samples) in enumerate(sounds):
+        lengths[row] = min(length, len(samples))
+        batch[row, :lengths[row]] = samples[:lengths[row]]
+    return batch, lengths
+
+
+def span_mask(batch: ndarray, lengths: ndarray) -> ndarray:
+    """True within the real length of each row, False over the padding"""
+    return np.arange(batch.shape[-1])[None, :] < lengths[:, None]
+
+
+def apply_gain(batch: ndarray, gain_db: ndarray) -> ndarray:
+    return batch * np.power(10.0, gain_db / 20.0)[:, None]
+
+
+def sample_at(batch: ndarray, positions: ndarray) -> ndarray:
+    """Linearly interpolate each row at (fractional) positions, zero outside the row"""
+    length = batch.shape[-1]
+    left = np.floor(positions).astype(np.int64)
+    fraction = positions - left
+    valid = (left >= 0) & (left < length - 1)
+    left = np.clip(left, 0, length - 2)
+    samples = (
+        np.take_along_axis(batch, left, axis=-1) * (1.0 - fraction)
+        + np.take_along_axis(batch, left + 1, axis=-1) * fraction
+    )
+    return np.where(valid, samples, 0.0)
+
+
+def apply_pitch_shift(batch: ndarray, semitones: ndarray) -> ndarray:
+    speed = np.power(2.0, semitones / 12.0)
+    return sample_at(batch, np.arange(batch.shape[-1])[None, :] * speed[:, None])
+
+
+def apply_transient_shift(batch: ndarray, shift: ndarray) -> ndarray:
+    return sample_at(batch, np.arange(batch.shape[-1])[None, :] - shift[:, None])
+
+
+def mix_noise(batch: ndarray, lengths: ndarray, noise: ndarray, snr_db: ndarray) -> ndarray:
+    """Mix noise within the real length of each row only, the SNR being measured over that span as well"""
+    span = span_mask(batch, lengths)
+    noise = np.where(span, noise, 0.0)
+    samples = np.maximum(lengths, 1)
+    signal_power = np.sum(np.where(span, batch, 0.0) ** 2, axis=-1) / samples
+    noise_power = np.maximum(np.sum(noise ** 2, axis=-1) / samples, 1e-12)
+    scale = np.sqrt(signal_power / np.power(10.0, snr_db / 10.0) / noise_power)
+    return batch + noise * scale[:, None]
+
+
+# FEATURE DOMAIN
+# spectrogram: (bins, frames)
+
+def stretch_frames(spectrogram: ndarray, rate: float) -> ndarray:
+    frames = spectrogram.shape[-1]
+    stretched = max(1, int(round(frames / rate)))
+    if stretched == frames:
+        return spectrogram
+    positions = np.linspace(0, frames - 1, stretched)
+    left = np.floor(positions).astype(np.int64)
+    right = np.minimum(left + 1, frames - 1)
+    fraction = positions - left
+    return spectrogram[..., left] * (1.0 - fraction) + spectrogram[..., right] * fraction
+
+
+def mask(spectrogram: ndarray, axis: int, start: float, width: float) -> ndarray:
+    """Set a band of the spectrogram to its minimum. start and width are fractions of the axis"""
+    size = spectrogram.shape[axis]
+    first = int(start * size)
+    last = min(size, first + int(round(width * size)))
+    if last <= first:
+        return spectrogram
+    masked = spectrogram.copy()
+    band = [slice(None)] * masked.ndim
+    band[axis] = slice(first, last)
+    masked[tuple(band)] = spectrogram.min()
+    return masked
+
+
+# RECIPES
+
+def variant_rng(recipe: AugmentationRecipe, file: File, variant: int) -> np.random.Generator:
+    """Each (recipe, file, variant) gets its own generator, such that results do not depend on batching"""
+    return np.random.default_rng([recipe.seed, variant, int(file.identity[:16], 16)])
+
+
+def augment_pcm(
+        recipe: AugmentationRecipe,
+        batch: ndarray,
+        lengths: ndarray,
+        rngs: list[np.random.Generator],
+) -> ndarray:
+    """Apply the PCM domain part of a recipe to a batch, one generator per row"""
+    def draw(value_range: tuple[float, float]) -> ndarray:
+        return np.array([rng.uniform(*value_range) for rng in rngs])
+
+    augmented = apply_gain(batch, draw(recipe.gain_db))
+    if recipe.pitch_shift != (0.0, 0.0):
+        augmented = apply_pitch_shift(augmented, draw(recipe.pitch_shift))
+    if recipe.transient_shift != (0.0, 0.0):
+        augmented = apply_transient_shift(augmented, draw(recipe.transient_shift) * preferences.SAMPLE_RATE)
+    if recipe.noise_snr_db is not None:
+        noise = np.stack([rng.standard_normal(batch.shape[-1]) for rng in rngs])
+        augmented = mix_noise(augmented, lengths, noise, draw(recipe.noise_snr_db))
+    return augmented.astype(np.float32)
+
+
+def augment_spectrograms(recipe: AugmentationRecipe, data: SPT, rng: np.random.Generator) -> SPT:
+    """Apply the feature domain part of a recipe to the spectrograms of a single sound.
+    Every spectrogram of the sound gets the same stretch and masks
+    """
+    rate = rng.uniform(*recipe.time_stretch)
+    freq_width, time_width = rng.uniform(0.0, recipe.freq_mask), rng.uniform(0.0, recipe.time_mask)
+    freq_start, time_start = rng.uniform(0.0, 1.0 - freq_width), rng.uniform(0.0, 1.0 - time_width)
+
+    augmented: SPT = dict(data)
+    for field in SPECTROGRAM_FIELDS:
+        if field in augmented:
+            spectrogram = stretch_frames(augmented[field], rate)  # type: ignore
+            spectrogram = mask(spectrogram, -2, freq_start, freq_width)
+            augmented[field] = mask(spectrogram, -1, time_start, time_width)
+    return augmented
+
+
+class Augmenter:
+    """Produces (and caches) augmented features of sounds, following a recipe.
+    Recipes with PCM domain augmentations extract features from augmented stacked PCM, in batches.
+    Feature domain only recipes work directly on (cached) original spectrograms, without touching the audio
+    """
+    processor: SoundProcessor
+    recipe: AugmentationRecipe
+    fingerprint: str
+    fields: list[str]
+    batch_size: int
+
+    def __init__(
+            self,
+            processor: SoundProcessor,
+            recipe: AugmentationRecipe,
+            fields: Iterable[str] | None = None,
+            batch_size: int = 32,
+    ):
+        self.processor = processor
+        self.recipe = recipe
+        self.fingerprint = recipe.fingerprint()
+        # Feature domain augmentations only apply to spectrograms. Other fields would not match the spectrograms
+        #   stored next to them (ie: unstretched mfcc), so such recipes can only augment (and default to) spectrograms
+        if fields is None and (recipe.needs_spectrograms() or not recipe.needs_pcm()):
+            fields = SPECTROGRAM_FIELDS
+        self.fields = requested_fields(fields)
+        self.batch_size = batch_size
+
+        if (recipe.needs_spectrograms() or not recipe.needs_pcm()) \
+                and any([field not in SPECTROGRAM_FIELDS for field in self.fields]):
+            raise Exception('Recipes with feature domain augmentations (time_stretch, freq_mask, time_mask) can only '
+                            'augment {}, got {}'.format(SPECTROGRAM_FIELDS, self.fields))
+
+    def is_cached(self, file: File) -> bool:
+        return all([
+            self.processor.is_augmented_cached(file, self.fingerprint, variant, self.fields)
+            for variant in range(self.recipe.variants)
+        ])
+
+    def augment(self, files: Iterable[File]) -> Iterator[tuple[File, list[SPT]]]:
+        """Augmented features of each file, one SPT per variant. Uncached ones get processed in batches
+
+        :param files: files to be augmented
+        :return: (file, variants) pairs, in order
+        """
+        batch: list[File] = []
+        for file in files:
+            batch.append(file)
+            if len(batch) >= self.batch_size:
+                yield from self.augment_batch(batch)
+                batch = []
+        yield from self.augment_batch(batch)
+
+    def augment_batch(self, files: list[File]) -> Iterator[tuple[File, list[SPT]]]:
+        uncached = [file for file in files if not self.is_cached(file)]
+        processed: dict[str, list[SPT]] = {}
+        if len(uncached) > 0:
+            processed = self.process_pcm(uncached) if self.recipe.needs_pcm() else self.process_features(uncached)
+            for file in uncached:
+                for (variant, data) in enumerate(processed[file.identity]):
+                    self.processor.cache_augmented(file, self.fingerprint, variant, data, self.recipe._asdict())
+
+        for file in files:
+            if file.identity in processed:
+                yield file, processed[file.identity]
+            else:
+                yield file, [
+                    self.processor.get_augmented_cache(file, self.fingerprint, variant, self.fields)
+                    for variant in range(self.recipe.variants)
+                ]
+
+    def process_features(self, files: list[File]) -> dict[str, list[SPT]]:
+        processed: dict[str, list[SPT]] = {}
+        for file in files:
+            original = self.processor.features(file, self.fields)
+            spectrograms = {field: original[field] for field in self.fields}
+            processed[file.identity] = [
+                augment_spectrograms(self.recipe, spectrograms, variant_rng(self.recipe, file, variant))
+                for variant in range(self.recipe.variants)
+            ]
+        return processed
+
+    def process_pcm(self, files: list[File]) -> dict[str, list[SPT]]:
+        batch, lengths = stack_sounds([preferences.load_sound(file.path)[0] for file in files])
+        batched_fields = [field for field in self.fields if field in BATCHABLE_FIELDS]
+        single_fields = [field for field in self.fields if field not in BATCHABLE_FIELDS]
+
+        processed: dict[str, list[SPT]] = {file.identity: [] for file in files}
+        for variant in range(self.recipe.variants):
+            rngs = [variant_rng(self.recipe, file, variant) for file in files]
+            augmented = augment_pcm(self.recipe, batch, lengths, rngs)
+            features = compute_features(augmented, preferences.SAMPLE_RATE, batched_fields)
+            for (row, file) in enumerate(files):
+                # Trimmed back to the real length of the sound, such that variants line up with the original features
+                frames = frame_count(lengths[row])
+                data: SPT = {field: features[field][row, ..., :frames] for field in batched_fields}
+                data.update(compute_features(augmented[row, :lengths[row]], preferences.SAMPLE_RATE, single_fields))
+                processed[file.identity].append(augment_spectrograms(self.recipe, data, rngs[row]))
+            del augmented, features
+        return processed
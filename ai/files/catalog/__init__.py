@@ -0,0 +1,205 @@
+import json
+import sqlite3
+import threading
+from os import path, listdir
+from typing import Iterable, Any
+
+import preferences
+from files.file import File
+from files.json import NpEncoder
+from files.processor.typings import DictBaseVals
+
+CATALOG_FILE = 'catalog.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sounds (
+    identity TEXT PRIMARY KEY,
+    name TEXT,
+    ext TEXT,
+    path TEXT,
+    -- native properties of the file
+    sample_rate INTEGER,
+    duration REAL,
+    -- sample rate features were extracted at
+    extraction_sample_rate INTEGER
+);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    identity TEXT NOT NULL,
+    category TEXT,
+    label TEXT
+);
+CREATE INDEX IF NOT EXISTS sounds_duration ON sounds (duration);
+CREATE INDEX IF NOT EXISTS sounds_sample_rate ON sounds (sample_rate);
+CREATE INDEX IF NOT EXISTS paths_identity ON paths (identity);
+CREATE INDEX IF NOT EXISTS paths_category ON paths (category);
+'''
+
+
+class SoundCatalog:
+    """Queryable metadata of cached sounds (the `info` of each `data.json`) and of the asset paths mapping to them.
+    One catalog lives in each versioned cache working directory, next to the cached identities
+    """
+    db_path: str
+    connection: sqlite3.Connection
+    # Guards transactions, the same connection might be shared between worker threads
+    lock: threading.Lock
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def sound_row(identity: str, info: DictBaseVals) -> tuple:
+        source_sample_rate, source_duration = info.get('source_sample_rate'), info.get('source_duration')
+        if source_sample_rate is None and path.isfile(str(info.get('path'))):
+            # cached before native properties were part of the info
+            source_sample_rate, source_duration = preferences.source_info(str(info.get('path')))
+        return (
+            identity, info.get('name'), info.get('ext'), info.get('path'),
+            source_sample_rate, source_duration, info.get('sample_rate'),
+        )
+
+    @classmethod
+    def in_directory(cls, directory: str):
+        return cls(path.join(directory, CATALOG_FILE))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
+    # WRITING
+    def add_sounds(self, sounds: Iterable[tuple[str, DictBaseVals]]):
+        """Bulk insert (or replace) sound info
+
+        :param sounds: pairs of (identity, info) where info is the `info` field of a processed SPT
+        :return: None
+        """
+        rows = [self.sound_row(identity, info) for (identity, info) in sounds]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO sounds '
+                '(identity, name, ext, path, sample_rate, duration, extraction_sample_rate) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    def add_sound(self, identity: str, info: DictBaseVals):
+        self.add_sounds([(identity, info)])
+
+    def add_files(self, files: Iterable[tuple[str, File, Any]]):
+        """Bulk insert (or replace) scanned asset files, as yielded by a DatasetFileHandler
+
+        :param files: tuples of (category, File, label). Labels get stored as json
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)',
+                [
+                    (file.path, file.identity, category, json.dumps(label, cls=NpEncoder))
+                    for (category, file, label) in files
+                ],
+            )
+
+    def remove_sound(self, identity: str):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM sounds WHERE identity = ?', (identity,))
+
+    def remove_path(self, file_path: str):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM paths WHERE path = ?', (file_path,))
+
+    def index_cache(self, cache_wd: str):
+        """Bulk import the `data.json` info of every identity already cached in the given directory
+
+        :param cache_wd: cache working directory of a SoundProcessor
+        :return: The number of imported sounds
+        """
+        sounds: list[tuple[str, DictBaseVals]] = []
+        for identity in listdir(cache_wd):
+            data_file = path.join(cache_wd, identity, 'data.json')
+            if path.isfile(data_file):
+                with open(data_file, 'r') as json_file:
+                    sounds.append((identity, json.load(json_file).get('info', {})))
+        self.add_sounds(sounds)
+        return len(sounds)
+
+    # READING
+    def has_sound(self, identity: str) -> bool:
+        with self.lock:
+            cursor = self.connection.execute('SELECT 1 FROM sounds WHERE identity = ?', (identity,))
+            return cursor.fetchone() is not None
+
+    def paths_of(self, identity: str) -> list[str]:
+        """Which asset paths map to this identity
+
+        :param identity: the identity of a file
+        :return: All known paths with the same content
+        """
+        with self.lock:
+            cursor = self.connection.execute('SELECT path FROM paths WHERE identity = ? ORDER BY path', (identity,))
+            return [row['path'] for row in cursor]
+
+    def identity_of(self, file_path: str) -> str | None:
+        with self.lock:
+            row = self.connection.execute('SELECT identity FROM paths WHERE path = ?', (file_path,)).fetchone()
+        return None if row is None else row['identity']
+
+    def sounds(
+            self,
+            category: str | None = None,
+            identity: str | None = None,
+            file_path: str | None = None,
+            sample_rate: int | None = None,
+            min_duration: float | None = None,
+            max_duration: float | None = None,
+    ) -> list[dict[str, Any]]:
+        """Filtered listing of cached sounds. A sound is listed once for every asset path pointing to it
+        (sounds that were never seen by a scan are listed once, without path specific info)
+
+        :param category: only sounds found under this category
+        :param identity: only this identity
+        :param file_path: only the sound found at this asset path
+        :param sample_rate: only sounds with this native sample rate
+        :param min_duration: only sounds at least this long (seconds, full length of the file)
+        :param max_duration: only sounds shorter than this (seconds, full length of the file)
+        :return: dicts of sound info along with `asset_path`, `category` and `label`
+        """
+        conditions: list[str] = []
+        params: list[Any] = []
+        for (condition, value) in [
+            ('p.category = ?', category),
+            ('s.identity = ?', identity),
+            ('p.path = ?', file_path),
+            ('s.sample_rate = ?', sample_rate),
+            ('s.duration >= ?', min_duration),
+            ('s.duration < ?', max_duration),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        query = '''
+            SELECT s.*, p.path AS asset_path, p.category AS category, p.label AS label
+            FROM sounds s LEFT JOIN paths p ON p.identity = s.identity
+        '''
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY p.category, p.path'
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [
+            {**dict(row), 'label': None if row['label'] is None else json.loads(row['label'])}
+            for row in rows
+        ]
@@ -6,12 +6,15 @@ T = TypeVar("T")
 
 
 class File:
+    # Many File instances are alive during bulk runs, keep them lean
+    __slots__ = ('path', 'name', 'ext', 'identity')
+
     path: str
     name: str
     ext: str
     identity: str
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, identity: str | None = None):
         if not opath.exists(path):
             raise Exception('File {} does not exist!'.format(path))
         if not opath.isfile(path):
@@ -21,7 +24,8 @@ class File:
         name, ext = opath.splitext(opath.basename(path))
         self.name = name
         self.ext = ext
-        self.identity = self.calculate_identity()
+        # An already known identity (ie: from another File of the same path) spares hashing the file again
+        self.identity = self.calculate_identity() if identity is None else identity
 
     def chunk_reducer(self, reducer: Callable[[T, AnyStr | str | bytes], T], init: T, chunk_size: int = 65536) -> T:
         next_iter: T = init
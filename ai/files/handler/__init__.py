@@ -2,6 +2,7 @@ from glob import glob
 from os import path, getcwd, listdir
 from typing import Type, TypeVar, Generic, Callable
 
+from files.catalog import SoundCatalog
 from files.processor import DatasetItemProcessor
 
 # Self type (DatasetFileHandler)
@@ -13,6 +14,12 @@ FileT = TypeVar("FileT")
 # The data type that the processing unit yields
 T = TypeVar("T")
 
+# How many scanned files are gathered before being written to the catalog
+CATALOG_BATCH_SIZE = 1024
+
+# Extensions of the asset files considered
+AUDIO_EXTENSIONS = ('.wav', '.WAV', '.mp3', '.MP3', '.ogg')
+
 
 # TODO: get_paths and get_paths_per_category should be optional stripped from this file
 # ie: other ways of fetching file paths exist (from serialized documents / http requests)
@@ -27,6 +34,8 @@ class DatasetFileHandler(Generic[LabelT, FileT, T]):
     label_strategy: Callable[[str, str], LabelT]
     file_map: Callable[[str], FileT]
     file_processor: Type[DatasetItemProcessor[FileT, T]]
+    # Optional catalog where scanned (category, FileT, LabelT) get recorded. FileT must be a File
+    catalog: SoundCatalog | None
 
     def __init__(
             self: SelfDFH,
@@ -34,6 +43,7 @@ class DatasetFileHandler(Generic[LabelT, FileT, T]):
             label_strategy: Callable[[str, str], LabelT],
             file_map: Callable[[str], FileT],
             file_processor: Type[DatasetItemProcessor[FileT, T]],
+            catalog: SoundCatalog | None = None,
     ):
         if not path.exists(base_path) or not path.isdir(base_path):
             raise Exception('Folder {} does not exist!'.format(base_path))
@@ -41,6 +51,7 @@ class DatasetFileHandler(Generic[LabelT, FileT, T]):
         self.label_strategy = label_strategy  # type: ignore
         self.file_map = file_map  # type: ignore
         self.file_processor = file_processor
+        self.catalog = catalog
 
         self.base_path = base_path
         self.categories = self.get_categories()
@@ -52,8 +63,9 @@ class DatasetFileHandler(Generic[LabelT, FileT, T]):
             label_strategy: Callable[[str, str], LabelT],
             file_map: Callable[[str], FileT],
             file_processor: Type[DatasetItemProcessor[FileT, T]],
+            catalog: SoundCatalog | None = None,
     ):
-        return cls(getcwd(), label_strategy, file_map, file_processor)
+        return cls(getcwd(), label_strategy, file_map, file_processor, catalog)
 
     @classmethod
     def for_folder(
@@ -62,16 +74,43 @@ class DatasetFileHandler(Generic[LabelT, FileT, T]):
             label_strategy: Callable[[str, str], LabelT],
             file_map: Callable[[str], FileT],
             file_processor: Type[DatasetItemProcessor[FileT, T]],
+            catalog: SoundCatalog | None = None,
     ):
         if folder is None:
-            return cls.from_cwd(label_strategy, file_map, file_processor)
-        return cls(folder, label_strategy, file_map, file_processor)
+            return cls.from_cwd(label_strategy, file_map, file_processor, catalog)
+        return cls(folder, label_strategy, file_map, file_processor, catalog)
 
     def cache_all(self):
-        for (_, files) in self.get_files_per_category():
-            for (file, _) in files:
-                if not self.file_processor.is_cached(file):
-                    self.file_processor.features(file)
+        self.for_each_file(self.cache_file)
+
+    def catalog_all(self):
+        self.for_each_file(lambda file: None)
+
+    def cache_file(self, file: FileT):
+        if not self.file_processor.is_cached(file):
+            self.file_processor.features(file)
+
+    def for_each_file(self, action: Callable[[FileT], None]):
+        """Map every path to a FileT, act on it and record it in the catalog (if any)
+        Files are mapped one at a time and catalogued in batches, such that memory does not grow with the dataset size
+
+        :param action: what to do with each FileT
+        :return: None
+        """
+        for (category, paths) in self.get_paths_per_category():
+            scanned: list[tuple[FileT, LabelT]] = []
+            for (p, label) in paths:
+                file = self.file_map(p)  # type: ignore
+                action(file)
+                scanned.append((file, label))
+                if len(scanned) >= CATALOG_BATCH_SIZE:
+                    self.catalog_files(category, scanned)
+                    scanned = []
+            self.catalog_files(category, scanned)
+
+    def catalog_files(self, category: str, files: list[tuple[FileT, LabelT]]):
+        if self.catalog is not None:
+            self.catalog.add_files([(category, file, label) for (file, label) in files])  # type: ignore
 
     def get_categories(self) -> list[str]:
         return get_asset_categories(self.base_path)
@@ -136,12 +175,9 @@ def get_asset_categories(asset_path: str) -> list[str]:
 
 
 def category_patterns(category: str, asset_path: str):
-    return (
-        '{assets}/{category}/**/*.wav'.format(category=category, assets=asset_path),
-        '{assets}/{category}/**/*.WAV'.format(category=category, assets=asset_path),
-        '{assets}/{category}/**/*.mp3'.format(category=category, assets=asset_path),
-        '{assets}/{category}/**/*.MP3'.format(category=category, assets=asset_path),
-        '{assets}/{category}/**/*.ogg'.format(category=category, assets=asset_path),
+    return tuple(
+        '{assets}/{category}/**/*{ext}'.format(category=category, assets=asset_path, ext=ext)
+        for ext in AUDIO_EXTENSIONS
     )
 
 
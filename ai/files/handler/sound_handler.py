@@ -7,12 +7,14 @@ from files.processor.typings import SPT
 
 
 def sound_handler(assets: str, cache: str, plots: bool) -> DatasetFileHandler[str, File, SPT]:
+    processor = SoundProcessor.init(
+        cache_dir=cache,
+        cache_plots=plots,
+    )
     return DatasetFileHandler[str, File, SPT].for_folder(
         folder=assets,
         label_strategy=most_significant_label,
         file_map=path_to_file,
-        file_processor=SoundProcessor.init(
-            cache_dir=cache,
-            cache_plots=plots,
-        )
+        file_processor=processor,
+        catalog=processor.catalog,
     )
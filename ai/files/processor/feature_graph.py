@@ -0,0 +1,157 @@
+from collections import Counter
+from typing import Callable, Iterable, NamedTuple
+
+import librosa  # type: ignore
+import numpy as np
+from numpy import ndarray
+
+import preferences
+
+# Every ndarray field a SoundProcessor can serve (and cache) for a sound
+ND_ARRAY_FIELDS = ['stft', 'mfcc', 'chroma', 'chroma_cens', 'mel', 'contrast', 'spectral_bandwidth', 'tonnetz']
+# Fields that can be computed for a whole batch of stacked samples (n, samples) at once, yielding the same per sound
+# result. Everything else depends on the batch and must be computed per sound: chroma features estimate tuning across
+#   the entire batch, spectral contrast clips its dB values relative to the peak of the entire batch
+BATCHABLE_FIELDS = ['stft', 'mfcc', 'mel', 'spectral_bandwidth']
+
+# Dynamic range of log mel spectrograms, same as the librosa default
+TOP_DB = 80.0
+# Hop length of every feature, same as the librosa default
+HOP_LENGTH = 512
+
+
+class FeatureNode(NamedTuple):
+    # Names of the nodes (features or intermediates) this node is computed from
+    dependencies: tuple[str, ...]
+    # Receives the sample rate followed by the values of the dependencies, in order
+    compute: Callable[..., ndarray]
+
+
+# The root of the graph. Its value is provided by whoever runs the graph, never computed
+SAMPLES = 'samples'
+
+# Features and intermediates, keyed by name. Intermediates are not part of ND_ARRAY_FIELDS, thus never cached
+# All stft based nodes share the librosa defaults (n_fft=2048, hop_length=512),
+#   so deriving them from the same magnitude spectrogram yields the same result as computing each one from `y`
+FEATURE_GRAPH: dict[str, FeatureNode] = {
+    'stft': FeatureNode(
+        (SAMPLES,),
+        lambda sr, y: np.abs(librosa.stft(y)),
+    ),
+    'mel': FeatureNode(
+        ('stft',),
+        lambda sr, stft: librosa.feature.melspectrogram(S=stft ** 2, sr=sr),
+    ),
+    'log_mel': FeatureNode(
+        ('mel',),
+        lambda sr, mel: power_to_db(mel),
+    ),
+    'mfcc': FeatureNode(
+        ('log_mel',),
+        lambda sr, log_mel: librosa.feature.mfcc(S=log_mel, sr=sr, n_mfcc=preferences.N_MFCC),
+    ),
+    'chroma': FeatureNode(
+        ('stft',),
+        lambda sr, stft: librosa.feature.chroma_stft(S=stft, sr=sr),
+    ),
+    'chroma_cens': FeatureNode(
+        (SAMPLES,),
+        lambda sr, y: librosa.feature.chroma_cens(y=y, sr=sr),
+    ),
+    'contrast': FeatureNode(
+        ('stft',),
+        lambda sr, stft: librosa.feature.spectral_contrast(S=stft, sr=sr),
+    ),
+    'spectral_bandwidth': FeatureNode(
+        ('stft',),
+        lambda sr, stft: librosa.feature.spectral_bandwidth(S=stft, sr=sr),
+    ),
+    'harmonic': FeatureNode(
+        (SAMPLES,),
+        lambda sr, y: librosa.effects.harmonic(y),
+    ),
+    'tonnetz': FeatureNode(
+        ('harmonic',),
+        lambda sr, harmonic: librosa.feature.tonnetz(y=harmonic, sr=sr),
+    ),
+}
+
+
+def power_to_db(mel: ndarray) -> ndarray:
+    """`librosa.power_to_db` clipped to TOP_DB below the peak of each sound, rather than the peak of the whole array
+    (those are the same for a single sound)
+
+    :param mel: mel spectrogram(s), (..., n_mels, frames)
+    :return: log mel spectrogram(s)
+    """
+    log_mel = librosa.power_to_db(mel, top_db=None)
+    return np.maximum(log_mel, log_mel.max(axis=(-2, -1), keepdims=True) - TOP_DB)
+
+
+def frame_count(samples: int) -> int:
+    """How many frames the features of a sound of this many samples have (centered frames, see HOP_LENGTH)"""
+    return 1 + samples // HOP_LENGTH
+
+
+def requested_fields(fields: Iterable[str] | None = None) -> list[str]:
+    """Normalize a feature request. No request means every field
+
+    :param fields: ndarray fields a consumer is interested in
+    :return: The requested fields, without duplicates, in ND_ARRAY_FIELDS order
+    """
+    if fields is None:
+        return list(ND_ARRAY_FIELDS)
+
+    if isinstance(fields, str):
+        fields = [fields]
+    requested = set(fields)
+    for field in requested:
+        if field not in ND_ARRAY_FIELDS:
+            raise Exception('Unknown feature {}! Known features are {}'.format(field, ND_ARRAY_FIELDS))
+    return [field for field in ND_ARRAY_FIELDS if field in requested]
+
+
+def resolve(fields: Iterable[str]) -> list[str]:
+    """Find every node needed to compute the given fields
+
+    :param fields: features to be computed
+    :return: All needed nodes (intermediates included, samples excluded) in an order in which they can be computed
+    """
+    order: list[str] = []
+
+    def visit(node: str):
+        if node == SAMPLES or node in order:
+            return
+        for dependency in FEATURE_GRAPH[node].dependencies:
+            visit(dependency)
+        order.append(node)
+
+    for field in fields:
+        visit(field)
+    return order
+
+
+def compute_features(samples: ndarray, sample_rate: int, fields: Iterable[str]) -> dict[str, ndarray]:
+    """Compute only the given fields (and whatever they depend on) for some loaded samples
+
+    :param samples: audio samples, as returned by `preferences.load_sound`
+    :param sample_rate: sample rate of the samples
+    :param fields: features to be computed
+    :return: The requested fields only, intermediates are discarded as soon as nothing depends on them
+    """
+    fields = list(fields)
+    order = resolve(fields)
+    dependants = Counter(dependency for node in order for dependency in FEATURE_GRAPH[node].dependencies)
+
+    values: dict[str, ndarray] = {SAMPLES: samples}
+    for node in order:
+        feature_node = FEATURE_GRAPH[node]
+        values[node] = feature_node.compute(
+            sample_rate,
+            *[values[dependency] for dependency in feature_node.dependencies],
+        )
+        for dependency in feature_node.dependencies:
+            dependants[dependency] -= 1
+            if dependants[dependency] == 0 and dependency not in fields:
+                del values[dependency]
+    return {field: values[field] for field in fields}
@@ -3,22 +3,23 @@ import librosa.display  # type: ignore
 from matplotlib import pyplot as plt  # type: ignore
 
 from shutil import rmtree
-from typing import ClassVar, NoReturn, Dict
+from typing import ClassVar, NoReturn, Dict, Iterable
 from os import path, makedirs
 import json
+import sqlite3
 
 import numpy as np
 from numpy import ndarray
 
+from files.catalog import SoundCatalog
 from files.processor import DatasetItemProcessor
 from files.file import File
 
 from files.json import NpEncoder, NpDecoder
+from files.processor.feature_graph import ND_ARRAY_FIELDS, requested_fields
 from files.processor.typings import SPT, NestedBaseVals
 from files.sound import SoundFile
 
-ND_ARRAY_FIELDS = ['stft', 'mfcc', 'chroma', 'chroma_cens', 'mel', 'contrast', 'spectral_bandwidth', 'tonnetz']
-
 
 # TODO see np.load and np.save, maybe `allow_pickle` should be False someday
 
@@ -34,6 +35,8 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
     # Plots are not always needed or queried, but when they are, cache them
     # This also checks for plots on already (impartial) cached data
     cache_plots: bool
+    # Metadata (info) of everything cached, queryable without opening each `data.json`
+    catalog: SoundCatalog
 
     def raise_permission_error(self, reason: str) -> NoReturn:
         raise Exception('Not enough permission to {}'.format(reason))
@@ -52,6 +55,7 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
             except Exception as e:
                 print(e)
                 self.raise_permission_error('create necessary caching directories')
+        self.catalog = SoundCatalog.in_directory(self.cache_wd)
 
     @classmethod
     def init(cls, cache_dir: str, cache_plots: bool = False, version: str = "0.0.1"):
@@ -67,20 +71,35 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
     def data_file(self, file: File):
         return path.join(self.cache_location(file), 'data.json')
 
-    def plot_files(self, file: File):
+    def plot_files(self, file: File, fields: Iterable[str] | None = None):
         plot_location = self.plot_location(file)
-        return [path.join(plot_location, '{}.png'.format(p)) for p in ND_ARRAY_FIELDS]
+        return [path.join(plot_location, '{}.png'.format(p)) for p in requested_fields(fields)]
 
-    def are_plots_cached(self, file: File):
+    def are_plots_cached(self, file: File, fields: Iterable[str] | None = None):
         plot_location = self.plot_location(file)
         if not path.exists(plot_location):
             return False
 
-        return all([path.exists(p) and path.isfile(p) for p in self.plot_files(file)])
+        return all([path.exists(p) and path.isfile(p) for p in self.plot_files(file, fields)])
 
-    def nd_array_files(self, file: File):
-        cache_location = self.cache_location(file)
-        return [path.join(cache_location, '{}.npy'.format(p)) for p in ND_ARRAY_FIELDS]
+    def nd_array_file(self, file: File, field: str):
+        return path.join(self.cache_location(file), '{}.npy'.format(field))
+
+    def nd_array_files(self, file: File, fields: Iterable[str] | None = None):
+        return [self.nd_array_file(file, p) for p in requested_fields(fields)]
+
+    def uncached_fields(self, file: File, fields: Iterable[str] | None = None) -> list[str]:
+        """Out of the requested fields, find the ones which are not cached yet
+
+        :param file: the file in question
+        :param fields: requested ndarray fields, all of them by default
+        :return: Fields which need processing
+        """
+        return [
+            field
+            for field in requested_fields(fields)
+            if not path.isfile(self.nd_array_file(file, field))
+        ]
 
     def cache_plot_files(self, file: File, data: SPT):
         plot_location = self.plot_location(file)
@@ -94,7 +113,7 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
                 self.raise_permission_error('create necessary caching directories')
 
         sr = data['info']['sample_rate']  # type: ignore
-        for plot_key in ND_ARRAY_FIELDS:
+        for plot_key in [field for field in ND_ARRAY_FIELDS if field in data]:
             plot_and_save(
                 data=data[plot_key],
                 sr=sr,
@@ -112,7 +131,7 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
             # )
 
     # ABSTRACT METHODS IMPL
-    def is_cached(self, file: File):
+    def is_cached(self, file: File, fields: Iterable[str] | None = None):
         cache_location = self.cache_location(file)
         if not path.exists(cache_location):
             return False
@@ -121,9 +140,9 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
         if path.exists(data_file) and not path.isfile(data_file):
             return False
 
-        return all([path.exists(p) and path.isfile(p) for p in self.nd_array_files(file)])
+        return all([path.exists(p) and path.isfile(p) for p in self.nd_array_files(file, fields)])
 
-    def get_cache(self, file) -> SPT:
+    def get_cache(self, file, fields: Iterable[str] | None = None) -> SPT:
         cache_location = self.cache_location(file)
         data_file = self.data_file(file)
         from_data: dict[str, int | float] = {}
@@ -142,7 +161,7 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
                 # 92,4999189413% faster for a 4.4MiB json file
                 # loaded_from_data[key] = np.asarray(value)
 
-        for nd_arr_field in ND_ARRAY_FIELDS:
+        for nd_arr_field in requested_fields(fields):
             ndarrays[nd_arr_field] = np.load(path.join(cache_location, '{}.npy'.format(nd_arr_field)))
             # To avoid NDARRAYS in json, provide all ndarray fields to ND_ARRAY_FIELDS
             #   that will cover both serialization and deserialization
@@ -191,21 +210,84 @@ class SoundProcessor(DatasetItemProcessor[File, SPT]):
                 rmtree(cache_location)
             finally:
                 return False
-        return True
 
-    def process(self, file: File) -> SPT:
-        with SoundFile.from_file(file) as sound:
-            return sound.features()
+        # The cached data is complete at this point, a catalog failure (ie: database locked by another process)
+        #   must not discard it. Missing catalog entries can be restored with `./main.py catalog`
+        if 'info' in from_data:
+            try:
+                self.catalog.add_sound(file.identity, from_data['info'])  # type: ignore
+            except sqlite3.Error as e:
+                print('Could not catalog {}: {}'.format(file.identity, e))
+        return True
 
-    # Override method to accommodate for plot caching
-    def features(self, file: File) -> SPT:
-        data: SPT = super().features(file)
+    # AUGMENTED DATA
+    # Augmented features live next to the originals, under `augmented/<recipe fingerprint>/<variant>`
+    def augmented_location(self, file: File, fingerprint: str, variant: int | None = None):
+        location = path.join(self.cache_location(file), 'augmented', fingerprint)
+        return location if variant is None else path.join(location, str(variant))
+
+    def is_augmented_cached(self, file: File, fingerprint: str, variant: int, fields: Iterable[str] | None = None):
+        location = self.augmented_location(file, fingerprint, variant)
+        return all([path.isfile(path.join(location, '{}.npy'.format(p))) for p in requested_fields(fields)])
+
+    def get_augmented_cache(self, file: File, fingerprint: str, variant: int, fields: Iterable[str] | None = None) -> SPT:
+        location = self.augmented_location(file, fingerprint, variant)
+        return {
+            field: np.load(path.join(location, '{}.npy'.format(field)))
+            for field in requested_fields(fields)
+        }
+
+    def cache_augmented(self, file: File, fingerprint: str, variant: int, data: SPT, recipe: NestedBaseVals) -> bool:
+        location = self.augmented_location(file, fingerprint, variant)
+        try:
+            makedirs(location, exist_ok=True)
+            recipe_file = path.join(self.augmented_location(file, fingerprint), 'recipe.json')
+            if not path.exists(recipe_file):
+                with open(recipe_file, 'w') as rf:
+                    json.dump(recipe, rf, cls=NpEncoder)
+            for key, value in data.items():
+                if isinstance(value, ndarray):
+                    np.save(path.join(location, '{}.npy'.format(key)), value)
+        except Exception as e:
+            print(e)
+            try:
+                rmtree(location)
+            finally:
+                return False
+        return True
 
-        if self.cache_plots and not self.are_plots_cached(file):
+    def process(self, file: File, fields: Iterable[str] | None = None) -> SPT:
+        with SoundFile.from_file(file) as sound:
+            return sound.features(fields)
+
+    # Override method to accommodate for plot caching and partial (demand-driven) processing
+    def features(self, file: File, fields: Iterable[str] | None = None) -> SPT:
+        """Get the requested fields of a file. Cached fields are loaded, only the missing ones get processed and cached
+
+        :param file: the file in question
+        :param fields: requested ndarray fields, all of them by default
+        :return: SPT containing `info` and the requested fields
+        """
+        fields = requested_fields(fields)
+        uncached = self.uncached_fields(file, fields)
+        cached = [field for field in fields if field not in uncached]
+
+        data: SPT = self.get_cache(file, cached) if path.exists(self.cache_location(file)) else {}
+        if len(uncached) > 0:
+            processed: SPT = self.process(file, uncached)
+            self.cache(file, processed)
+            data = {**data, **processed}
+
+        if self.cache_plots and not self.are_plots_cached(file, fields):
             self.cache_plot_files(file, data)
 
         return data
 
+    def cache_if_uncached(self, file: File, fields: Iterable[str] | None = None):
+        uncached = self.uncached_fields(file, fields)
+        if len(uncached) > 0:
+            self.cache(file, self.process(file, uncached))
+
 
 def plot_and_save(data, sr, file_path):
     fig, ax = plt.subplots()
@@ -215,3 +297,4 @@ def plot_and_save(data, sr, file_path):
         ax=ax
     )
     plt.savefig(file_path)
+    plt.close(fig)
@@ -1,23 +1,32 @@
-import librosa  # type: ignore
-import numpy as np
+from typing import Iterable
 
 import preferences
 from files.file import File
 from numpy import ndarray
 
+from files.processor.feature_graph import compute_features, requested_fields
 from files.processor.typings import SPT
 
 
 class SoundFile(File):
-    # soundfile data
+    __slots__ = ('samples', 'sample_rate', 'duration', 'source_sample_rate', 'source_duration')
+
+    # soundfile data (samples are only available while loaded, ie: inside `with _ as _`)
     samples: ndarray
-    sample_rate: int = 0
+    sample_rate: int
 
     # Relevant info
-    duration: int = 0
-
-    def __init__(self, path: str):
-        super().__init__(path)
+    duration: int
+    # Native properties of the file (the samples are resampled and truncated, see `preferences.load_sound`)
+    source_sample_rate: int
+    source_duration: float
+
+    def __init__(self, path: str, identity: str | None = None):
+        super().__init__(path, identity)
+        self.sample_rate = 0
+        self.duration = 0
+        self.source_sample_rate = 0
+        self.source_duration = 0
 
     @classmethod
     def from_path(cls, path: str):
@@ -25,7 +34,7 @@ class SoundFile(File):
 
     @classmethod
     def from_file(cls, file: File):
-        return cls(file.path)
+        return cls(file.path, file.identity)
 
     def load_sound(self):
         """Load the audio file and set relevant information
@@ -36,6 +45,7 @@ class SoundFile(File):
         self.samples = samples
         self.sample_rate = sample_rate
         self.duration = duration
+        self.source_sample_rate, self.source_duration = preferences.source_info(self.path)
 
     def is_loaded(self):
         """ Check if the SoundFile instance has loaded the audio file itself. This yields true when using `with _ as _`
@@ -44,59 +54,32 @@ class SoundFile(File):
         """
         return not(self.duration <= 0 or self.sample_rate <= 0 or not hasattr(self, 'samples'))
 
-    def features(self) -> SPT:
-        stft: ndarray = np.abs(librosa.stft(self.samples))
-
-        mfcc: ndarray = librosa.feature.mfcc(
-            y=self.samples,
-            sr=self.sample_rate,
-            n_mfcc=preferences.N_MFCC,
-        )
-
-        chroma: ndarray = librosa.feature.chroma_stft(
-            S=stft,
-            sr=self.sample_rate,
-        )
-        chroma_cens: ndarray = librosa.feature.chroma_cens(
-            y=self.samples,
-            sr=self.sample_rate
-        )
-
-        mel: ndarray = librosa.feature.melspectrogram(
-            y=self.samples,
-            sr=self.sample_rate,
-        )
-
-        contrast: ndarray = librosa.feature.spectral_contrast(
-            S=stft,
-            sr=self.sample_rate,
-        )
-        spectral_bandwidth: ndarray = librosa.feature.spectral_bandwidth(
-            y=self.samples,
-            sr=self.sample_rate,
-        )
-
-        tonnetz: ndarray = librosa.feature.tonnetz(
-            y=librosa.effects.harmonic(self.samples),
-            sr=self.sample_rate,
-        )
+    def release_sound(self):
+        """Drop the loaded samples. Sound info (sample_rate, duration) is kept
 
+        :return: None
+        """
+        if hasattr(self, 'samples'):
+            del self.samples
+
+    def features(self, fields: Iterable[str] | None = None) -> SPT:
+        """Compute the requested ndarray fields (all of them by default) along with the sound info.
+        Only what the requested fields depend on gets computed, see `files.processor.feature_graph`
+
+        :param fields: ndarray fields to be computed
+        :return: SPT containing `info` and the requested fields
+        """
         return {
             'info': {
                 'sample_rate': self.sample_rate,
                 'duration': self.duration,
+                'source_sample_rate': self.source_sample_rate,
+                'source_duration': self.source_duration,
                 'name': self.name,
                 'ext': self.ext,
                 'path': self.path,
             },
-            'stft': stft,
-            'mfcc': mfcc,
-            'chroma': chroma,
-            'chroma_cens': chroma_cens,
-            'mel': mel,
-            'contrast': contrast,
-            'spectral_bandwidth': spectral_bandwidth,
-            'tonnetz': tonnetz,
+            **compute_features(self.samples, self.sample_rate, requested_fields(fields)),
         }
 
     def __enter__(self):
@@ -104,6 +87,7 @@ class SoundFile(File):
         return self
 
     def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.release_sound()
         if exception_type is not None or exception_type is not None:
             print("Error thrown when dealing with a SoundFile")
             print(exception_type)
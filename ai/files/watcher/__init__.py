@@ -0,0 +1,361 @@
+import json
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from os import path, scandir, stat, remove
+from shutil import rmtree
+from typing import Iterable
+
+from files.file import File
+from files.handler import AUDIO_EXTENSIONS
+from files.handler.labelling_strategies import most_significant_label
+from files.processor.feature_graph import requested_fields
+from files.processor.sound_processor import SoundProcessor
+
+# (size, mtime in ns) of a file. A file is considered changed when any of these differ
+Snapshot = tuple[int, int]
+# (path, detection time, snapshot) of a file ready to be processed
+ReadyFile = tuple[str, float, Snapshot]
+
+# How many times a file is retried when its worker dies (ie: killed by the OOM killer) before being given up on
+MAX_ATTEMPTS = 3
+
+
+class PendingFile:
+    """A new (or changed) file that is not yet trusted to be completely written"""
+    __slots__ = ('snapshot', 'detected', 'changed')
+
+    snapshot: Snapshot
+    # When the watcher first noticed it (monotonic), used for ingest lag
+    detected: float
+    # When the watcher last noticed it changing (monotonic), used for debouncing
+    changed: float
+
+    def __init__(self, snapshot: Snapshot, now: float):
+        self.snapshot = snapshot
+        self.detected = now
+        self.changed = now
+
+
+class AssetWatcher:
+    """Polls an asset directory for new or changed audio files, without any OS specific notification mechanism.
+    Only directories whose mtime changed get listed again (every directory is listed on a full scan, which also
+    catches files overwritten in place). Files are reported once their size and mtime settle
+    """
+    assets: str
+    settle: float
+    full_scan_interval: float
+
+    # directory -> mtime (ns) when it was last listed
+    directories: dict[str, int]
+    # directory -> {file name -> snapshot} of already reported files
+    files: dict[str, dict[str, Snapshot]]
+    # path -> file waiting to settle
+    pending: dict[str, PendingFile]
+    # paths that disappeared since the last poll
+    removed: list[str]
+    last_full_scan: float
+
+    def __init__(self, assets: str, settle: float = 1.0, full_scan_interval: float = 60.0, existing: bool = False):
+        """
+        :param assets: the assets path, files are expected inside category directories
+        :param settle: for how long (seconds) a file must stay unchanged before being reported
+        :param full_scan_interval: how often (seconds) every directory is listed, regardless of its mtime
+        :param existing: report files that already exist as well, otherwise only what arrives from now on
+        """
+        if not path.exists(assets) or not path.isdir(assets):
+            raise Exception('Folder {} does not exist!'.format(assets))
+
+        self.assets = path.normpath(assets)
+        self.settle = settle
+        self.full_scan_interval = full_scan_interval
+        self.directories = {}
+        self.files = {}
+        self.pending = {}
+        self.removed = []
+
+        now = time.monotonic()
+        self.last_full_scan = now
+        self.scan_directory(self.assets, now)
+        if not existing:
+            for (file_path, pending) in self.pending.items():
+                self.files[path.dirname(file_path)][path.basename(file_path)] = pending.snapshot
+            self.pending = {}
+
+    def scan_directory(self, directory: str, now: float):
+        try:
+            mtime = stat(directory).st_mtime_ns
+            with scandir(directory) as listing:
+                entries = list(listing)
+        except OSError:
+            # Vanished while being scanned, the next poll forgets it (or never learns about it)
+            return
+        self.directories[directory] = mtime
+        known = self.files.setdefault(directory, {})
+        seen: set[str] = set()
+
+        for entry in entries:
+            # Entries can disappear at any point (ie: temporary upload files), those are treated as unseen
+            try:
+                if entry.is_dir():
+                    if entry.path not in self.directories:
+                        self.scan_directory(entry.path, now)
+                elif entry.is_file() and directory != self.assets and entry.name.endswith(AUDIO_EXTENSIONS):
+                    entry_stat = entry.stat()
+                    seen.add(entry.name)
+                    self.observe(entry.path, (entry_stat.st_size, entry_stat.st_mtime_ns), known.get(entry.name), now)
+            except OSError:
+                continue
+
+        for name in [name for name in known if name not in seen]:
+            del known[name]
+            self.removed.append(path.join(directory, name))
+        for file_path in [p for p in self.pending if path.dirname(p) == directory and path.basename(p) not in seen]:
+            del self.pending[file_path]
+
+    def observe(self, file_path: str, snapshot: Snapshot, known: Snapshot | None, now: float):
+        if snapshot == known:
+            return
+        pending = self.pending.get(file_path)
+        if pending is None:
+            self.pending[file_path] = PendingFile(snapshot, now)
+        elif pending.snapshot != snapshot:
+            pending.snapshot = snapshot
+            pending.changed = now
+
+    def forget_directory(self, directory: str):
+        for name in self.files.pop(directory, {}):
+            self.removed.append(path.join(directory, name))
+        del self.directories[directory]
+        for file_path in [p for p in self.pending if path.dirname(p) == directory]:
+            del self.pending[file_path]
+
+    def poll(self) -> list[tuple[str, float, Snapshot]]:
+        """Look for changes and report the files that settled
+
+        :return: (path, detection time, snapshot) of files ready to be processed. Detection time is `time.monotonic`
+        """
+        now = time.monotonic()
+        full_scan = now - self.last_full_scan >= self.full_scan_interval
+        if full_scan:
+            self.last_full_scan = now
+
+        for directory in list(self.directories):
+            if directory not in self.directories:  # forgotten along with its parent
+                continue
+            try:
+                mtime = stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                for forgotten in [d for d in self.directories if d == directory or d.startswith(directory + '/')]:
+                    self.forget_directory(forgotten)
+                continue
+            if full_scan or mtime != self.directories[directory]:
+                self.scan_directory(directory, now)
+
+        ready: list[tuple[str, float, Snapshot]] = []
+        for (file_path, pending) in list(self.pending.items()):
+            try:
+                file_stat = stat(file_path)
+            except OSError:
+                del self.pending[file_path]
+                continue
+            self.observe(file_path, (file_stat.st_size, file_stat.st_mtime_ns), None, now)
+            if now - pending.changed >= self.settle:
+                del self.pending[file_path]
+                self.files[path.dirname(file_path)][path.basename(file_path)] = pending.snapshot
+                ready.append((file_path, pending.detected, pending.snapshot))
+        return ready
+
+    def recheck(self, file_path: str, detected: float):
+        """Wait for a reported file to settle again (ie: it changed while being processed), keeping its detection time
+
+        :param file_path: path of an already reported file
+        :param detected: when the file was first detected (monotonic)
+        :return: None
+        """
+        try:
+            file_stat = stat(file_path)
+        except OSError:
+            return  # removed, the scan of its directory takes care of it
+        now = time.monotonic()
+        self.files.get(path.dirname(file_path), {}).pop(path.basename(file_path), None)
+        self.observe(file_path, (file_stat.st_size, file_stat.st_mtime_ns), None, now)
+        self.pending[file_path].detected = detected
+
+    def take_removed(self) -> list[str]:
+        removed, self.removed = self.removed, []
+        return removed
+
+
+# WORKERS
+# Each worker process owns its SoundProcessor (and catalog connection)
+worker_processor: SoundProcessor | None = None
+
+
+def init_worker(cache_dir: str, version: str):
+    global worker_processor
+    # Ctrl-C reaches the whole process group, only the main loop handles it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_processor = SoundProcessor.init(cache_dir=cache_dir, version=version)
+
+
+def current_snapshot(file_path: str) -> Snapshot | None:
+    try:
+        file_stat = stat(file_path)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def ingest(file_path: str, snapshot: Snapshot, fields: list[str]) -> tuple[str, str, float, bool]:
+    """Cache a file reported by the watcher. The file is hashed and read at different moments, if it changed in between
+    (ie: overwritten by an upload) the cached features might belong to another content than the identity says.
+    In that case everything this call wrote is reverted
+
+    :return: path, identity, processing time and whether the file was left intact (False means it must be processed again)
+    """
+    processor: SoundProcessor = worker_processor  # type: ignore
+    started = time.monotonic()
+    file = File(file_path)
+
+    cache_location = processor.cache_location(file)
+    data_file = processor.data_file(file)
+    existed = path.exists(cache_location)
+    previous_data = None
+    if path.isfile(data_file):
+        with open(data_file, 'r') as df:
+            previous_data = df.read()
+    uncached = processor.uncached_fields(file, fields)
+
+    processor.cache_if_uncached(file, fields)
+
+    intact = current_snapshot(file_path) == snapshot
+    if not intact and len(uncached) > 0:
+        if not existed:
+            rmtree(cache_location, ignore_errors=True)
+            processor.catalog.remove_sound(file.identity)
+        else:
+            for field in uncached:
+                if path.exists(processor.nd_array_file(file, field)):
+                    remove(processor.nd_array_file(file, field))
+            if previous_data is None:
+                if path.exists(data_file):
+                    remove(data_file)
+                processor.catalog.remove_sound(file.identity)
+            else:
+                with open(data_file, 'w') as df:
+                    df.write(previous_data)
+                info = json.loads(previous_data).get('info')
+                if info is not None:
+                    processor.catalog.add_sound(file.identity, info)
+    return file_path, file.identity, time.monotonic() - started, intact
+
+
+def watch(
+        assets: str,
+        cache_dir: str,
+        workers: int,
+        fields: Iterable[str] | None = None,
+        poll_interval: float = 0.5,
+        settle: float = 1.0,
+        full_scan_interval: float = 60.0,
+        existing: bool = False,
+):
+    """Watch the asset folder forever, pushing new or changed files through the SoundProcessor pipeline.
+    Prints a json line for every ingested file, with its ingest lag (detection to cached) and the pending work
+
+    :param assets: the assets path
+    :param cache_dir: the caching directory
+    :param workers: number of worker processes
+    :param fields: only extract these features, all of them by default
+    :param poll_interval: seconds between polls
+    :param settle: seconds a file must stay unchanged before being processed
+    :param full_scan_interval: seconds between full scans of the asset folder
+    :param existing: process files that already exist as well
+    :return: None
+    """
+    # Validated before any worker starts. fire passes a single field as a plain string
+    fields = requested_fields(fields)
+    processor = SoundProcessor.init(cache_dir=cache_dir)
+    watcher = AssetWatcher(assets, settle, full_scan_interval, existing)
+
+    # Ready files wait here, such that the pool never holds more than `workers` tasks and new files are picked up fast
+    queue: deque[ReadyFile] = deque()
+    running: dict[Future, ReadyFile] = {}
+    # path -> how many times a worker died while processing it
+    attempts: dict[str, int] = {}
+
+    def start_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(cache_dir, SoundProcessor.version),
+        )
+
+    def restart_pool(broken: ProcessPoolExecutor, reason: BrokenProcessPool) -> ProcessPoolExecutor:
+        print('Worker pool broke ({}), restarting it'.format(reason))
+        broken.shutdown(wait=False, cancel_futures=True)
+        # The pool does not tell which file took it down, every running file counts as an attempt
+        for ready in running.values():
+            attempts[ready[0]] = attempts.get(ready[0], 0) + 1
+            if attempts[ready[0]] < MAX_ATTEMPTS:
+                queue.appendleft(ready)
+            else:
+                print('Giving up on {} after {} attempts'.format(ready[0], MAX_ATTEMPTS))
+        running.clear()
+        return start_pool()
+
+    pool = start_pool()
+    try:
+        while True:
+            queue.extend(watcher.poll())
+            for removed in watcher.take_removed():
+                processor.catalog.remove_path(removed)
+
+            try:
+                while len(queue) > 0 and len(running) < workers:
+                    ready = queue[0]
+                    running[pool.submit(ingest, ready[0], ready[2], fields)] = ready
+                    queue.popleft()
+            except BrokenProcessPool as e:
+                pool = restart_pool(pool, e)
+                continue
+
+            if len(running) == 0:
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(list(running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken: BrokenProcessPool | None = None
+            for future in done:
+                (file_path, detected, _) = ready = running.pop(future)
+                try:
+                    (file_path, identity, processing, intact) = future.result()
+                    attempts.pop(file_path, None)
+                    if not intact:
+                        watcher.recheck(file_path, detected)
+                        continue
+                    label = most_significant_label(file_path, watcher.assets)
+                    processor.catalog.add_files([(label, File(file_path, identity), label)])
+                except BrokenProcessPool as e:
+                    running[future] = ready  # requeued (or given up on) along with the rest
+                    broken = e
+                    continue
+                except Exception as e:
+                    print(e)
+                    continue
+                print(json.dumps({
+                    'path': file_path,
+                    'identity': identity,
+                    'ingest_lag': time.monotonic() - detected,
+                    'processing': processing,
+                    'pending': len(queue) + len(running) + len(watcher.pending),
+                }), flush=True)
+            if broken is not None:
+                pool = restart_pool(pool, broken)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -1,10 +1,15 @@
 #!./venv/bin/python3.10
 
+import json
+from os import cpu_count
+
 import fire  # type: ignore
 
+from files.augmentation import AugmentationRecipe, Augmenter
 from files.file import File
 from files.handler.sound_handler import sound_handler
 from files.processor.sound_processor import SoundProcessor
+from files.watcher import watch as watch_assets
 
 
 class Main(object):
@@ -20,23 +25,165 @@ class Main(object):
         sound_handler(assets=assets, cache=cache, plots=plots).cache_all()
 
     @staticmethod
-    def process(file_path: str, cache_dir: str = './cached', plots: bool = False, discard: bool = False):
+    def watch(
+            assets: str = './assets',
+            cache: str = './cached',
+            workers: int | None = None,
+            fields: list[str] | None = None,
+            poll_interval: float = 0.5,
+            settle: float = 1.0,
+            full_scan_interval: float = 60.0,
+            existing: bool = False,
+    ):
+        """Watch an asset folder and cache new or changed files as they arrive (polling, no OS specific dependency)
+
+        :param assets: the assets path
+        :param cache: the caching directory
+        :param workers: number of worker processes, defaults to the number of CPUs
+        :param fields: only extract these features, all of them by default
+        :param poll_interval: seconds between polls of the asset folder
+        :param settle: seconds a file must stay unchanged (ie: done uploading) before being processed
+        :param full_scan_interval: seconds between full scans, which also catch files overwritten in place
+        :param existing: also process files that already exist when starting
+        :returns: prints a json line for every ingested file, containing its identity and ingest lag
+        """
+        watch_assets(
+            assets=assets,
+            cache_dir=cache,
+            workers=workers or cpu_count() or 1,
+            fields=fields,
+            poll_interval=poll_interval,
+            settle=settle,
+            full_scan_interval=full_scan_interval,
+            existing=existing,
+        )
+
+    @staticmethod
+    def process(
+            file_path: str,
+            cache_dir: str = './cached',
+            plots: bool = False,
+            discard: bool = False,
+            fields: list[str] | None = None,
+    ):
         """Extract features of this audio file for caching purposes
 
         :param file_path: path to audio file
         :param cache_dir: cashed results will get here, inside a unique folder named `<file_identity>`
         :param plots: consider generating plots or not
         :param discard: should discard (delete) the input file after processing
+        :param fields: only extract these features (ie: `--fields='[mfcc,contrast]'`), all of them by default
         :returns: prints the identity of the file, such that results can be traced to `cache_dir/file_identity`
         """
         file = File(file_path)
-        SoundProcessor.init(cache_dir=cache_dir, cache_plots=plots).process(file)
+        SoundProcessor.init(cache_dir=cache_dir, cache_plots=plots).features(file, fields)
 
         if discard:
             file.delete()
 
         print(file.identity)
 
+    @staticmethod
+    def augment(
+            assets: str = './assets',
+            cache: str = './cached',
+            fields: list[str] | None = None,
+            seed: int = 0,
+            variants: int = 1,
+            gain_db: tuple[float, float] = (0.0, 0.0),
+            pitch_shift: tuple[float, float] = (0.0, 0.0),
+            noise_snr_db: tuple[float, float] | None = None,
+            transient_shift: tuple[float, float] = (0.0, 0.0),
+            time_stretch: tuple[float, float] = (1.0, 1.0),
+            freq_mask: float = 0.0,
+            time_mask: float = 0.0,
+            batch_size: int = 32,
+    ):
+        """Cache augmented features of every asset, next to the original features. Ranges are given as `[low,high]`
+
+        :param assets: the assets path
+        :param cache: the caching directory
+        :param fields: only augment these features. Defaults to all of them, or to stft and mel for recipes
+            with feature domain augmentations (those can only augment stft and mel)
+        :param seed: seed of the recipe, same seed same results
+        :param variants: how many augmented versions of each sound to produce
+        :param gain_db: gain range, in dB
+        :param pitch_shift: tape style pitch shift range, in semitones
+        :param noise_snr_db: signal to noise ratio range of the mixed white noise, in dB
+        :param transient_shift: delay range of the transient, in seconds
+        :param time_stretch: time stretch rate range, applied to the stft and mel spectrograms
+        :param freq_mask: maximum fraction of frequency bins to mask in the stft and mel spectrograms
+        :param time_mask: maximum fraction of frames to mask in the stft and mel spectrograms
+        :param batch_size: how many sounds are augmented at once
+        :returns: prints the recipe fingerprint, such that results can be traced to `cache/<file_identity>/augmented`
+        """
+        def value_range(name, values):
+            if values is None:
+                return None
+            if not isinstance(values, (list, tuple)) or len(values) != 2:
+                raise Exception('--{} must be a range of two numbers (ie: --{}=[-3,3]), got {}'.format(name, name, values))
+            return float(values[0]), float(values[1])
+
+        recipe = AugmentationRecipe(
+            seed=seed,
+            variants=variants,
+            gain_db=value_range('gain_db', gain_db),
+            pitch_shift=value_range('pitch_shift', pitch_shift),
+            noise_snr_db=value_range('noise_snr_db', noise_snr_db),
+            transient_shift=value_range('transient_shift', transient_shift),
+            time_stretch=value_range('time_stretch', time_stretch),
+            freq_mask=float(freq_mask),
+            time_mask=float(time_mask),
+        )
+        handler = sound_handler(assets=assets, cache=cache, plots=False)
+        augmenter = Augmenter(handler.file_processor, recipe, fields, batch_size)  # type: ignore
+        for _ in augmenter.augment(handler.file_map(p) for (_, p, _) in handler.get_paths()):  # type: ignore
+            pass
+
+        print(augmenter.fingerprint)
+
+    @staticmethod
+    def catalog(assets: str = './assets', cache: str = './cached'):
+        """Rebuild the metadata catalog of a caching directory from already cached data and an asset folder
+
+        :param assets: the assets path
+        :param cache: the caching directory
+        :returns: prints the number of catalogued sounds
+        """
+        handler = sound_handler(assets=assets, cache=cache, plots=False)
+        handler.catalog_all()
+        print(handler.file_processor.catalog.index_cache(handler.file_processor.cache_wd))  # type: ignore
+
+    @staticmethod
+    def query(
+            cache: str = './cached',
+            category: str | None = None,
+            identity: str | None = None,
+            file_path: str | None = None,
+            sample_rate: int | None = None,
+            min_duration: float | None = None,
+            max_duration: float | None = None,
+    ):
+        """List cached sounds matching all the given filters, using the metadata catalog of the caching directory
+
+        :param cache: the caching directory
+        :param category: only sounds found under this category
+        :param identity: only this identity
+        :param file_path: only the sound found at this asset path
+        :param sample_rate: only sounds with this native sample rate
+        :param min_duration: only sounds at least this long (seconds, full length of the file)
+        :param max_duration: only sounds shorter than this (seconds, full length of the file)
+        :returns: prints a json containing an array of sound info
+        """
+        print(json.dumps(SoundProcessor.init(cache_dir=cache).catalog.sounds(
+            category=category,
+            identity=identity,
+            file_path=file_path,
+            sample_rate=sample_rate,
+            min_duration=min_duration,
+            max_duration=max_duration,
+        )))
+
     @staticmethod
     def classify(file_path: str, model_identifier: str):
         """Using one of the requested trained models classify the given audio file
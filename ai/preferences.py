@@ -27,3 +27,12 @@ def load_sound(file_path: str) -> tuple[ndarray, int, int]:
         duration=MAX_DURATION,
     )
     return librosa.util.normalize(samples), sample_rate, float(len(samples)) / sample_rate
+
+
+def source_info(file_path: str) -> tuple[int, float]:
+    """Native properties of the file, regardless of how `load_sound` resamples and truncates it
+
+    :param file_path: Path to the desired file
+    :return: [native sample rate, full duration in seconds]
+    """
+    return int(librosa.get_samplerate(file_path)), float(librosa.get_duration(path=file_path))